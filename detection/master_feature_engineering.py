@@ -1,4 +1,6 @@
 from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import gc
 import re
 import sqlite3
 import pandas as pd
@@ -9,11 +11,109 @@ import os
 from pathlib import Path
 from datetime import datetime, timezone
 
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pacsv
+except ImportError:
+    pa = None
+
 sys.path.append(str(Path(__file__).parent))
 
 
 NOW_TS = int(datetime.now(timezone.utc).timestamp())
 
+ACTIVITY_CHUNK_SIZE = 500_000
+
+WORD_RE = re.compile(r"\w+")
+
+NUMERIC_DTYPES = ["float64", "float32", "int64", "int32"]
+KEY_COLS = ["id", "user_id", "target_is_bot"]
+
+ACTIVITY_COUNTER_COLS = ["followers", "friends", "photos", "videos", "audios", "groups"]
+SOCIAL_COUNTER_COLS = [
+    "followers",
+    "friends",
+    "groups",
+    "subscriptions",
+    "mutual_friends",
+    "online_friends",
+]
+
+FEATURE_DB_SETUP = """
+    PRAGMA journal_mode=WAL;
+    CREATE INDEX IF NOT EXISTS ix_comments_from_id ON comments(from_id);
+"""
+FEATURE_CONNECTION_PRAGMAS = """
+    PRAGMA synchronous=NORMAL;
+    PRAGMA cache_size=-262144;
+    PRAGMA temp_store=MEMORY;
+"""
+
+PROFILE_SIDE_TABLES = {
+    "profile_texts": [
+        "status",
+        "activity",
+        "about",
+        "interests",
+        "books",
+        "tv",
+        "quotes",
+        "games",
+        "movies",
+        "music",
+    ],
+    "profile_extras": [
+        "site",
+        "mobile_phone",
+        "home_phone",
+        "photo_50",
+        "photo_100",
+        "photo_200",
+        "photo_400",
+        "photo_max",
+        "photo_base",
+        "photo_avg_color",
+        "photo_id",
+        "cover_photo_url",
+    ],
+}
+
+
+def attach_profile_side_views(conn) -> None:
+    tables = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    }
+    profile_cols = {row[1] for row in conn.execute("PRAGMA table_info(profiles)")}
+    for table, cols in PROFILE_SIDE_TABLES.items():
+        if table in tables:
+            continue
+        select_cols = ", ".join(
+            c if c in profile_cols else f"NULL AS {c}" for c in cols
+        )
+        conn.execute(
+            f"CREATE TEMP VIEW IF NOT EXISTS {table} AS "
+            f"SELECT id AS profile_id, {select_cols} FROM profiles"
+        )
+
+
+def connect_feature_db(sqlite_path: str, **kwargs) -> sqlite3.Connection:
+    conn = sqlite3.connect(sqlite_path, **kwargs)
+    conn.executescript(FEATURE_CONNECTION_PRAGMAS)
+    attach_profile_side_views(conn)
+    return conn
+
+
+def prepare_feature_db(conn) -> None:
+    conn.executescript(FEATURE_DB_SETUP)
+
+
+def write_features_csv(df: pd.DataFrame, path: str) -> None:
+    if pa is None:
+        df.to_csv(path, index=False)
+        return
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path)
+
 
 def calculate_text_entropy(text: str) -> float:
     if not text or len(text) < 2:
@@ -291,20 +391,21 @@ def build_profile_text_features(conn) -> pd.DataFrame:
     profiles = pd.read_sql(
         """
         SELECT 
-            id,
-            user_id,
-            first_name,
-            last_name,
-            status,
-            about,
-            interests,
-            books,
-            tv,
-            quotes,
-            games,
-            movies,
-            music
-        FROM profiles
+            p.id,
+            p.user_id,
+            p.first_name,
+            p.last_name,
+            t.status,
+            t.about,
+            t.interests,
+            t.books,
+            t.tv,
+            t.quotes,
+            t.games,
+            t.movies,
+            t.music
+        FROM profiles p
+        LEFT JOIN profile_texts t ON t.profile_id = p.id
     """,
         conn,
     )
@@ -530,7 +631,7 @@ def build_linguistic_features(conn) -> pd.DataFrame:
 
 
 def build_all_text_features(sqlite_path: str, output_path: str):
-    conn = sqlite3.connect(sqlite_path)
+    conn = connect_feature_db(sqlite_path)
     comment_text = build_comment_text_features(conn)
     profile_text = build_profile_text_features(conn)
     linguistic = build_linguistic_features(conn)
@@ -543,14 +644,10 @@ def build_all_text_features(sqlite_path: str, output_path: str):
     if not linguistic.empty:
         result = result.merge(linguistic, on="user_id", how="left")
 
-    for col in result.columns:
-        if col != "user_id":
-            if result[col].dtype in ["float64", "float32"]:
-                result[col] = result[col].fillna(0)
-            elif result[col].dtype in ["int64", "int32"]:
-                result[col] = result[col].fillna(0)
+    num_cols = result.select_dtypes(NUMERIC_DTYPES).columns.difference(["user_id"])
+    result[num_cols] = result[num_cols].fillna(0)
 
-    result.to_csv(output_path, index=False)
+    write_features_csv(result, output_path)
 
     return result
 
@@ -875,7 +972,7 @@ def calculate_local_clustering_coefficient(conn) -> pd.DataFrame:
 
 
 def build_all_network_features(sqlite_path: str, output_path: str):
-    conn = sqlite3.connect(sqlite_path)
+    conn = connect_feature_db(sqlite_path)
     follower_net = build_follower_network_features(conn)
     sub_net = build_subscription_network_features(conn)
     comment_net = build_comment_interaction_features(conn)
@@ -899,14 +996,12 @@ def build_all_network_features(sqlite_path: str, output_path: str):
     if not clustering.empty:
         result = result.merge(clustering, on="user_id", how="left")
 
-    for col in result.columns:
-        if col not in ["id", "user_id"]:
-            if result[col].dtype in ["float64", "float32"]:
-                result[col] = result[col].fillna(0)
-            elif result[col].dtype in ["int64", "int32"]:
-                result[col] = result[col].fillna(0)
+    num_cols = result.select_dtypes(NUMERIC_DTYPES).columns.difference(
+        ["id", "user_id"]
+    )
+    result[num_cols] = result[num_cols].fillna(0)
 
-    result.to_csv(output_path, index=False)
+    write_features_csv(result, output_path)
     return result
 
 
@@ -916,7 +1011,7 @@ def build_temporal_features(conn) -> pd.DataFrame:
         SELECT 
             p.id,
             p.user_id,
-            p.registered_at,
+            p.registered_at as registered_date,
             p.last_seen_ts,
             p.collected_at,
             p.online,
@@ -930,23 +1025,15 @@ def build_temporal_features(conn) -> pd.DataFrame:
         LEFT JOIN profile_counters c ON p.id = c.profile_id
     """,
         conn,
+        parse_dates={"registered_date": {"errors": "coerce"}},
+        dtype={col: "float64" for col in ACTIVITY_COUNTER_COLS},
     )
 
-    profiles["registered_date"] = pd.to_datetime(
-        profiles["registered_at"], errors="coerce"
-    )
     profiles["account_age_days"] = (
         datetime.now() - profiles["registered_date"]
     ).dt.days
 
-    profiles["total_activity"] = (
-        pd.to_numeric(profiles["followers"], errors='coerce').fillna(0).astype('Int64')
-        + pd.to_numeric(profiles["friends"], errors='coerce').fillna(0).astype('Int64')
-        + pd.to_numeric(profiles["photos"], errors='coerce').fillna(0).astype('Int64')
-        + pd.to_numeric(profiles["videos"], errors='coerce').fillna(0).astype('Int64')
-        + pd.to_numeric(profiles["audios"], errors='coerce').fillna(0).astype('Int64')
-        + pd.to_numeric(profiles["groups"], errors='coerce').fillna(0).astype('Int64')
-    )
+    profiles["total_activity"] = profiles[ACTIVITY_COUNTER_COLS].fillna(0).sum(axis=1)
 
     profiles["activity_per_day"] = np.where(
         profiles["account_age_days"] > 0,
@@ -975,9 +1062,9 @@ def build_temporal_features(conn) -> pd.DataFrame:
         np.nan,
     )
 
-    reg_date_counts = profiles.groupby(profiles["registered_date"].dt.date).size()
+    reg_day = profiles["registered_date"].dt.normalize()
     profiles["accounts_registered_same_day"] = (
-        profiles["registered_date"].dt.date.map(reg_date_counts).fillna(0)
+        reg_day.groupby(reg_day).transform("size").fillna(0)
     )
 
     temporal_cols = [
@@ -1009,27 +1096,29 @@ def build_authenticity_features(conn) -> pd.DataFrame:
             p.city_title,
             p.country_title,
             p.home_town,
-            p.status,
-            p.about,
-            p.interests,
-            p.books,
-            p.tv,
-            p.quotes,
-            p.games,
-            p.movies,
-            p.music,
-            p.site,
-            p.mobile_phone,
-            p.home_phone,
-            p.photo_50,
-            p.photo_100,
-            p.photo_200,
-            p.photo_400,
+            t.status,
+            t.about,
+            t.interests,
+            t.books,
+            t.tv,
+            t.quotes,
+            t.games,
+            t.movies,
+            t.music,
+            e.site,
+            e.mobile_phone,
+            e.home_phone,
+            e.photo_50,
+            e.photo_100,
+            e.photo_200,
+            e.photo_400,
             p.verified,
             p.is_sber_verified,
             p.is_tinkoff_verified,
             p.is_esia_verified
         FROM profiles p
+        LEFT JOIN profile_texts t ON t.profile_id = p.id
+        LEFT JOIN profile_extras e ON e.profile_id = p.id
     """,
         conn,
     )
@@ -1054,13 +1143,16 @@ def build_authenticity_features(conn) -> pd.DataFrame:
         & (profiles["first_name_cyrillic_ratio"] < 1)
     ).astype(int)
 
-    profiles["first_name_len"] = profiles["first_name"].astype(str).str.len()
-    profiles["last_name_len"] = profiles["last_name"].astype(str).str.len()
+    fn_str = profiles["first_name"].astype(str)
+    ln_str = profiles["last_name"].astype(str)
+
+    profiles["first_name_len"] = fn_str.str.len()
+    profiles["last_name_len"] = ln_str.str.len()
     profiles["full_name_len"] = profiles["first_name_len"] + profiles["last_name_len"]
 
     profiles["name_has_digits"] = (
-        profiles["first_name"].astype(str).str.contains(r"\d", regex=True, na=False)
-        | profiles["last_name"].astype(str).str.contains(r"\d", regex=True, na=False)
+        fn_str.str.contains(r"\d", regex=True, na=False)
+        | ln_str.str.contains(r"\d", regex=True, na=False)
     ).astype(int)
 
     text_fields = [
@@ -1075,17 +1167,17 @@ def build_authenticity_features(conn) -> pd.DataFrame:
         "music",
     ]
 
-    profiles["text_fields_filled_count"] = sum(
-        profiles[field].notna() & (profiles[field].astype(str).str.strip() != "")
-        for field in text_fields
-    )
-
-    def count_unique_words(row):
-        text = " ".join([str(row[f]) for f in text_fields if pd.notna(row[f])])
-        words = re.findall(r"\w+", text.lower())
-        return len(set(words)) if words else 0
+    text_block = profiles[text_fields].fillna("").astype(str)
+    profiles["text_fields_filled_count"] = (
+        text_block.apply(lambda col: col.str.strip()) != ""
+    ).sum(axis=1)
 
-    profiles["profile_unique_words"] = profiles.apply(count_unique_words, axis=1)
+    joined = text_block[text_fields[0]].str.cat(
+        [text_block[f] for f in text_fields[1:]], sep=" "
+    )
+    profiles["profile_unique_words"] = [
+        len(set(WORD_RE.findall(text))) for text in joined.str.lower()
+    ]
 
     def avg_text_length(row):
         lengths = [
@@ -1098,9 +1190,9 @@ def build_authenticity_features(conn) -> pd.DataFrame:
     profiles["profile_avg_text_length"] = profiles.apply(avg_text_length, axis=1)
 
     photo_cols = ["photo_50", "photo_100", "photo_200", "photo_400"]
-    profiles["photo_sizes_count"] = sum(
-        profiles[col].notna() & (profiles[col].astype(str) != "") for col in photo_cols
-    )
+    profiles["photo_sizes_count"] = (
+        profiles[photo_cols].fillna("").astype(str) != ""
+    ).sum(axis=1)
 
     profiles["has_contact_info"] = (
         profiles["site"].notna()
@@ -1108,11 +1200,14 @@ def build_authenticity_features(conn) -> pd.DataFrame:
         | profiles["home_phone"].notna()
     ).astype(int)
 
+    verification_cols = [
+        "verified",
+        "is_sber_verified",
+        "is_tinkoff_verified",
+        "is_esia_verified",
+    ]
     profiles["verification_count"] = (
-        profiles["verified"].fillna(0).astype(bool).astype(int)
-        + profiles["is_sber_verified"].fillna(0).astype(bool).astype(int)
-        + profiles["is_tinkoff_verified"].fillna(0).astype(bool).astype(int)
-        + profiles["is_esia_verified"].fillna(0).astype(bool).astype(int)
+        profiles[verification_cols].fillna(0).astype(bool).sum(axis=1)
     )
 
     profiles["has_city"] = profiles["city_title"].notna().astype(int)
@@ -1157,10 +1252,11 @@ def build_social_graph_features(conn) -> pd.DataFrame:
         FROM profile_counters
     """,
         conn,
+        dtype={col: "float64" for col in SOCIAL_COUNTER_COLS},
     )
 
-    counters["friends"] = pd.to_numeric(counters["friends"], errors='coerce').fillna(0)
-    counters["followers"] = pd.to_numeric(counters["followers"], errors='coerce').fillna(0)
+    counters["friends"] = counters["friends"].fillna(0)
+    counters["followers"] = counters["followers"].fillna(0)
 
     counters["ff_ratio"] = np.where(
         counters["followers"] > 0, counters["friends"] / counters["followers"], np.inf
@@ -1172,19 +1268,19 @@ def build_social_graph_features(conn) -> pd.DataFrame:
 
     counters["mutual_friends_rate"] = np.where(
         counters["friends"] > 0,
-        pd.to_numeric(counters["mutual_friends"], errors='coerce').fillna(0) / counters["friends"],
+        counters["mutual_friends"].fillna(0) / counters["friends"],
         0,
     )
 
     counters["online_friends_rate"] = np.where(
         counters["friends"] > 0,
-        pd.to_numeric(counters["online_friends"], errors='coerce').fillna(0) / counters["friends"],
+        counters["online_friends"].fillna(0) / counters["friends"],
         0,
     )
 
     counters["groups_to_subs_ratio"] = np.where(
-        pd.to_numeric(counters["subscriptions"], errors='coerce').fillna(0) > 0,
-        pd.to_numeric(counters["groups"], errors='coerce').fillna(0) / pd.to_numeric(counters["subscriptions"], errors='coerce').fillna(1),
+        counters["subscriptions"].fillna(0) > 0,
+        counters["groups"].fillna(0) / counters["subscriptions"].fillna(1),
         0,
     )
 
@@ -1254,101 +1350,131 @@ def build_social_graph_features(conn) -> pd.DataFrame:
     return result
 
 
+def _iter_complete_users(chunks, key: str = "user_id"):
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if chunk.empty:
+            continue
+        complete = chunk[key] != chunk[key].iat[-1]
+        carry = chunk[~complete]
+        if complete.any():
+            yield chunk[complete]
+    if carry is not None and not carry.empty:
+        yield carry
+
+
+def _add_activity_columns(comments: pd.DataFrame) -> pd.DataFrame:
+    comments["datetime"] = pd.to_datetime(
+        comments["timestamp"], unit="s", errors="coerce"
+    )
+    comments["hour"] = comments["datetime"].dt.hour
+    comments["day_of_week"] = comments["datetime"].dt.dayofweek
+    return comments
+
+
+def _user_activity_features(user_id, group: pd.DataFrame) -> dict:
+    group = group.sort_values("timestamp")
+
+    intervals = group["timestamp"].diff().dropna() / 60.0
+
+    features = {
+        "user_id": user_id,
+        "comments_count": len(group),
+        "comment_interval_mean_minutes": intervals.mean()
+        if len(intervals) > 0
+        else np.nan,
+        "comment_interval_std_minutes": intervals.std()
+        if len(intervals) > 0
+        else np.nan,
+        "comment_interval_cv": intervals.std() / intervals.mean()
+        if len(intervals) > 0 and intervals.mean() > 0
+        else np.nan,
+        "suspiciously_regular_intervals": int(
+            (intervals.std() / intervals.mean() < 0.5)
+            if len(intervals) > 0 and intervals.mean() > 0
+            else False
+        ),
+        "hour_entropy": stats.entropy(group["hour"].value_counts(normalize=True))
+        if len(group) > 5
+        else np.nan,
+        "night_activity_rate": (group["hour"].between(0, 6).sum() / len(group)),
+        "weekend_activity_rate": (
+            group["day_of_week"].isin([5, 6]).sum() / len(group)
+        ),
+        "hour_distribution_uniformity": 1
+        - (group["hour"].value_counts().std() / group["hour"].value_counts().mean())
+        if len(group["hour"].value_counts()) > 1
+        else 0,
+        "text_len_mean": group["text_len"].mean(),
+        "text_len_std": group["text_len"].std(),
+        "text_len_cv": group["text_len"].std() / group["text_len"].mean()
+        if group["text_len"].mean() > 0
+        else np.nan,
+        "unique_text_ratio": group["text_hash"].nunique() / len(group)
+        if len(group) > 0
+        else 0,
+        "most_common_text_freq": group["text_hash"].value_counts().iloc[0]
+        / len(group)
+        if len(group) > 0
+        else 0,
+        "avg_likes_per_comment": group["likes"].mean(),
+        "median_likes_per_comment": group["likes"].median(),
+        "zero_likes_rate": (group["likes"] == 0).sum() / len(group),
+        "reply_rate": group["reply_to_comment_id"].notna().sum() / len(group),
+        "deleted_rate": pd.to_numeric(group["is_deleted"], errors='coerce').fillna(0).astype(int).sum() / len(group),
+        "edited_rate": pd.to_numeric(group["is_edited"], errors='coerce').fillna(0).astype(int).sum() / len(group),
+        "max_comments_in_hour": group.groupby(group["datetime"].dt.floor("h"))
+        .size()
+        .max(),
+        "max_comments_in_day": group.groupby(group["datetime"].dt.date)
+        .size()
+        .max(),
+        "activity_span_days": (group["timestamp"].max() - group["timestamp"].min())
+        / 86400.0,
+        "comments_per_active_day": len(group)
+        / ((group["timestamp"].max() - group["timestamp"].min()) / 86400.0 + 1),
+    }
+
+    return features
+
+
+def _strhash(text: str | None) -> int | None:
+    return None if text is None else hash(text)
+
+
 def build_activity_pattern_features(conn) -> pd.DataFrame:
-    comments = pd.read_sql(
+    conn.create_function("strhash", 1, _strhash, deterministic=True)
+    chunks = pd.read_sql(
         """
         SELECT 
             from_id as user_id,
             timestamp,
-            text,
+            LENGTH(text) as text_len,
+            strhash(text) as text_hash,
             likes,
             reply_to_comment_id,
             is_deleted,
             is_edited
         FROM comments
         WHERE from_id IS NOT NULL AND from_id > 0
+        ORDER BY from_id, timestamp
     """,
         conn,
+        chunksize=ACTIVITY_CHUNK_SIZE,
     )
 
-    if comments.empty:
-        return pd.DataFrame({"user_id": []})
-
-    comments["datetime"] = pd.to_datetime(
-        comments["timestamp"], unit="s", errors="coerce"
-    )
-    comments["hour"] = comments["datetime"].dt.hour
-    comments["day_of_week"] = comments["datetime"].dt.dayofweek
-    comments["text_len"] = comments["text"].astype(str).str.len()
-
     activity_patterns = []
 
-    for user_id, group in comments.groupby("user_id"):
-        if len(group) < 2:
-            continue
-
-        group = group.sort_values("timestamp")
-
-        intervals = group["timestamp"].diff().dropna() / 60.0
-
-        features = {
-            "user_id": user_id,
-            "comments_count": len(group),
-            "comment_interval_mean_minutes": intervals.mean()
-            if len(intervals) > 0
-            else np.nan,
-            "comment_interval_std_minutes": intervals.std()
-            if len(intervals) > 0
-            else np.nan,
-            "comment_interval_cv": intervals.std() / intervals.mean()
-            if len(intervals) > 0 and intervals.mean() > 0
-            else np.nan,
-            "suspiciously_regular_intervals": int(
-                (intervals.std() / intervals.mean() < 0.5)
-                if len(intervals) > 0 and intervals.mean() > 0
-                else False
-            ),
-            "hour_entropy": stats.entropy(group["hour"].value_counts(normalize=True))
-            if len(group) > 5
-            else np.nan,
-            "night_activity_rate": (group["hour"].between(0, 6).sum() / len(group)),
-            "weekend_activity_rate": (
-                group["day_of_week"].isin([5, 6]).sum() / len(group)
-            ),
-            "hour_distribution_uniformity": 1
-            - (group["hour"].value_counts().std() / group["hour"].value_counts().mean())
-            if len(group["hour"].value_counts()) > 1
-            else 0,
-            "text_len_mean": group["text_len"].mean(),
-            "text_len_std": group["text_len"].std(),
-            "text_len_cv": group["text_len"].std() / group["text_len"].mean()
-            if group["text_len"].mean() > 0
-            else np.nan,
-            "unique_text_ratio": group["text"].nunique() / len(group)
-            if len(group) > 0
-            else 0,
-            "most_common_text_freq": group["text"].value_counts().iloc[0] / len(group)
-            if len(group) > 0
-            else 0,
-            "avg_likes_per_comment": group["likes"].mean(),
-            "median_likes_per_comment": group["likes"].median(),
-            "zero_likes_rate": (group["likes"] == 0).sum() / len(group),
-            "reply_rate": group["reply_to_comment_id"].notna().sum() / len(group),
-            "deleted_rate": pd.to_numeric(group["is_deleted"], errors='coerce').fillna(0).astype(int).sum() / len(group),
-            "edited_rate": pd.to_numeric(group["is_edited"], errors='coerce').fillna(0).astype(int).sum() / len(group),
-            "max_comments_in_hour": group.groupby(group["datetime"].dt.floor("h"))
-            .size()
-            .max(),
-            "max_comments_in_day": group.groupby(group["datetime"].dt.date)
-            .size()
-            .max(),
-            "activity_span_days": (group["timestamp"].max() - group["timestamp"].min())
-            / 86400.0,
-            "comments_per_active_day": len(group)
-            / ((group["timestamp"].max() - group["timestamp"].min()) / 86400.0 + 1),
-        }
+    for comments in _iter_complete_users(map(_add_activity_columns, chunks)):
+        for user_id, group in comments.groupby("user_id"):
+            if len(group) < 2:
+                continue
+            activity_patterns.append(_user_activity_features(user_id, group))
 
-        activity_patterns.append(features)
+    if not activity_patterns:
+        return pd.DataFrame({"user_id": []})
 
     activity_df = pd.DataFrame(activity_patterns)
 
@@ -1501,18 +1627,38 @@ def build_education_career_features(conn) -> pd.DataFrame:
     return result
 
 
-def build_all_advanced_features(sqlite_path: str, output_path: str):
-    conn = sqlite3.connect(sqlite_path)
-    profiles = pd.read_sql("SELECT id, user_id, is_bot FROM profiles", conn)
+def _build_with_own_connection(sqlite_path: str, builder) -> pd.DataFrame:
+    conn = connect_feature_db(sqlite_path, check_same_thread=False)
+    try:
+        return builder(conn)
+    finally:
+        conn.close()
 
-    temporal = build_temporal_features(conn)
-    authenticity = build_authenticity_features(conn)
-    social = build_social_graph_features(conn)
-    activity = build_activity_pattern_features(conn)
-    education = build_education_career_features(conn)
 
+def build_all_advanced_features(sqlite_path: str, output_path: str):
+    conn = connect_feature_db(sqlite_path)
+    prepare_feature_db(conn)
+    profiles = pd.read_sql("SELECT id, user_id, is_bot FROM profiles", conn)
     conn.close()
 
+    builders = [
+        build_temporal_features,
+        build_authenticity_features,
+        build_social_graph_features,
+        build_activity_pattern_features,
+        build_education_career_features,
+    ]
+    with ThreadPoolExecutor(
+        max_workers=len(builders), thread_name_prefix="features"
+    ) as ex:
+        futures = [
+            ex.submit(_build_with_own_connection, sqlite_path, builder)
+            for builder in builders
+        ]
+        temporal, authenticity, social, activity, education = [
+            fut.result() for fut in futures
+        ]
+
     result = profiles.merge(temporal, on="id", how="left")
     result = result.merge(authenticity, on="id", how="left")
 
@@ -1542,19 +1688,16 @@ def build_all_advanced_features(sqlite_path: str, output_path: str):
     result["target_is_bot"] = result["is_bot"].fillna(-1).astype(int)
     result = result.drop(columns=["is_bot"], errors="ignore")
 
-    for col in result.columns:
-        if col in ["id", "user_id", "target_is_bot"]:
-            continue
-
-        if result[col].dtype in ["float64", "float32"]:
-            if "ratio" in col or "rate" in col or "score" in col:
-                result[col] = result[col].fillna(0)
-            else:
-                result[col] = result[col].fillna(result[col].median())
-        elif result[col].dtype in ["int64", "int32"]:
-            result[col] = result[col].fillna(0)
+    float_cols = result.select_dtypes(["float64", "float32"]).columns.difference(
+        KEY_COLS
+    )
+    int_cols = result.select_dtypes(["int64", "int32"]).columns.difference(KEY_COLS)
+    rate_mask = float_cols.str.contains("ratio|rate|score")
+    fill_map = dict.fromkeys(float_cols[rate_mask].union(int_cols), 0)
+    fill_map.update(result[float_cols[~rate_mask]].median().to_dict())
+    result.fillna(fill_map, inplace=True)
 
-    result.to_csv(output_path, index=False)
+    write_features_csv(result, output_path)
     return result
 
 
@@ -1599,62 +1742,54 @@ def build_complete_feature_set(
     if profile_features is None:
         return None
 
-    merged = profile_features.copy()
+    merged = profile_features
+    del profile_features
+    key_pos = merged.columns.get_loc("user_id")
+    merged = merged.set_index("user_id")
+
     if text_features is not None and not text_features.empty:
-        merged = merged.merge(
-            text_features.drop(columns=["id"], errors="ignore"),
-            on="user_id",
+        merged = merged.join(
+            text_features.drop(columns=["id"], errors="ignore").set_index("user_id"),
             how="left",
-            suffixes=("", "_text"),
+            rsuffix="_text",
         )
+    del text_features
+
+    if (
+        network_features is not None
+        and not network_features.empty
+        and "user_id" in network_features.columns
+    ):
+        cols_to_drop = [c for c in network_features.columns if c in merged.columns]
+        merged = merged.join(
+            network_features.drop(columns=cols_to_drop).set_index("user_id"),
+            how="left",
+        )
+    del network_features
+    gc.collect()
 
-    if network_features is not None and not network_features.empty:
-        merge_cols = []
-        if "user_id" in network_features.columns:
-            merge_cols.append("user_id")
-        if "id" in network_features.columns and "id" in merged.columns:
-            if "user_id" not in merge_cols:
-                merge_cols.append("id")
-
-        if merge_cols:
-            cols_to_drop = [
-                c
-                for c in network_features.columns
-                if c in merged.columns and c not in merge_cols
-            ]
-            network_to_merge = network_features.drop(
-                columns=cols_to_drop, errors="ignore"
-            )
-
-            merged = merged.merge(
-                network_to_merge, on=merge_cols, how="left", suffixes=("", "_net")
-            )
+    merged = merged.reset_index()
+    merged.insert(key_pos, "user_id", merged.pop("user_id"))
 
     merged = merged.loc[:, ~merged.columns.duplicated()]
-    for col in merged.select_dtypes(include=[np.number]).columns:
-        merged[col] = merged[col].replace([np.inf, -np.inf], np.nan)
+    inf_cols = merged.select_dtypes(include=[np.number]).columns
+    merged[inf_cols] = merged[inf_cols].replace([np.inf, -np.inf], np.nan)
 
-    for col in merged.columns:
-        if col in ["id", "user_id", "target_is_bot"]:
-            continue
+    num_cols = merged.select_dtypes(NUMERIC_DTYPES).columns.difference(KEY_COLS)
+    zero_mask = num_cols.str.lower().str.contains(
+        "ratio|rate|score|per_|count|total|sum|num_"
+    )
+    fill_map = dict.fromkeys(num_cols[zero_mask], 0)
+    fill_map.update(merged[num_cols[~zero_mask]].median().fillna(0).to_dict())
+    merged.fillna(fill_map, inplace=True)
 
-        if merged[col].dtype in ["float64", "float32", "int64", "int32"]:
-            if any(
-                keyword in col.lower() for keyword in ["ratio", "rate", "score", "per_"]
-            ):
-                merged[col] = merged[col].fillna(0)
-            elif any(
-                keyword in col.lower() for keyword in ["count", "total", "sum", "num_"]
-            ):
-                merged[col] = merged[col].fillna(0)
-            else:
-                median_val = merged[col].median()
-                merged[col] = merged[col].fillna(
-                    median_val if pd.notna(median_val) else 0
-                )
+    float_cols = merged.select_dtypes("float64").columns.difference(KEY_COLS)
+    merged[float_cols] = merged[float_cols].astype("float32")
+    int_cols = merged.select_dtypes("int64").columns.difference(KEY_COLS)
+    merged[int_cols] = merged[int_cols].astype("int32")
 
     final_path = os.path.join(output_dir, final_output)
-    merged.to_csv(final_path, index=False)
+    write_features_csv(merged, final_path)
 
     return merged
 
@@ -0,0 +1,17 @@
+from typing import Any
+
+from storage.comment import save_comments
+from storage.models import batch_transaction, vk_session
+from storage.post import save_posts
+
+
+def save_batch(
+    posts: list[dict[str, Any]],
+    comments: list[dict[str, Any]],
+    db_path: str = "vk.sqlite",
+    durability: str = "normal",
+):
+    with vk_session(db_path) as session:
+        with batch_transaction(session, len(posts) + len(comments), durability):
+            save_posts(posts, session=session)
+            save_comments(comments, session=session)
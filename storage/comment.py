@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Any
 from sqlalchemy import (
     Column,
@@ -8,12 +9,39 @@ from sqlalchemy import (
     Boolean,
     Index,
     UniqueConstraint,
+    delete,
+    func,
+    select,
 )
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import relationship
 
-from storage.models import Base, make_session
+from storage.models import (
+    TMP_COMMENT_KEYS,
+    TMP_PARENTS,
+    TMP_POST_KEYS,
+    Base,
+    batch_transaction,
+    fill_temp_table,
+    group_rows_by_columns,
+    insert_many_raw,
+    sync_child_rows,
+    vk_session,
+)
 from storage.post import Post
 
+COMMENT_OVERWRITE_COLS = [
+    "from_id",
+    "author_name",
+    "reply_to_comment_id",
+    "date_text",
+    "timestamp",
+    "text",
+    "likes",
+    "is_deleted",
+    "is_edited",
+]
+
 
 class Comment(Base):
     __tablename__ = "comments"
@@ -41,21 +69,20 @@ class Comment(Base):
     collected_at = Column(Integer, nullable=True)
 
     attachments = relationship(
-        "CommentAttachment", cascade="all, delete-orphan", back_populates="comment"
+        "CommentAttachment", lazy="selectin", viewonly=True, back_populates="comment"
     )
     hashtags = relationship(
-        "CommentHashtag", cascade="all, delete-orphan", back_populates="comment"
+        "CommentHashtag", lazy="selectin", viewonly=True, back_populates="comment"
     )
     mentions = relationship(
-        "CommentMention", cascade="all, delete-orphan", back_populates="comment"
+        "CommentMention", lazy="selectin", viewonly=True, back_populates="comment"
     )
     urls = relationship(
-        "CommentURL", cascade="all, delete-orphan", back_populates="comment"
+        "CommentURL", lazy="selectin", viewonly=True, back_populates="comment"
     )
 
     __table_args__ = (
         UniqueConstraint("owner_id", "post_id", "comment_id", name="uq_comment_key"),
-        Index("ix_comment_post", "owner_id", "post_id"),
         Index("ix_comment_ts", "timestamp"),
     )
 
@@ -71,7 +98,7 @@ class CommentAttachment(Base):
     src = Column(String(1024))
     extra_json = Column(Text)
 
-    comment = relationship("Comment", back_populates="attachments")
+    comment = relationship("Comment", back_populates="attachments", viewonly=True)
 
     __table_args__ = (
         UniqueConstraint(
@@ -83,149 +110,215 @@ class CommentAttachment(Base):
 
 class CommentHashtag(Base):
     __tablename__ = "comment_hashtags"
-    id = Column(Integer, primary_key=True, autoincrement=True)
     comment_id_fk = Column(
-        Integer, ForeignKey("comments.id", ondelete="CASCADE"), nullable=False
+        Integer, ForeignKey("comments.id", ondelete="CASCADE"), primary_key=True
     )
-    tag = Column(String(128), nullable=False)
-    comment = relationship("Comment", back_populates="hashtags")
+    tag = Column(String(128), primary_key=True)
+    comment = relationship("Comment", back_populates="hashtags", viewonly=True)
     __table_args__ = (
-        UniqueConstraint("comment_id_fk", "tag", name="uq_comment_tag"),
         Index("ix_comment_tag", "tag"),
+        {"sqlite_with_rowid": False},
     )
 
 
 class CommentMention(Base):
     __tablename__ = "comment_mentions"
-    id = Column(Integer, primary_key=True, autoincrement=True)
     comment_id_fk = Column(
-        Integer, ForeignKey("comments.id", ondelete="CASCADE"), nullable=False
+        Integer, ForeignKey("comments.id", ondelete="CASCADE"), primary_key=True
     )
-    handle = Column(String(128), nullable=False)
-    comment = relationship("Comment", back_populates="mentions")
+    handle = Column(String(128), primary_key=True)
+    comment = relationship("Comment", back_populates="mentions", viewonly=True)
     __table_args__ = (
-        UniqueConstraint("comment_id_fk", "handle", name="uq_comment_handle"),
         Index("ix_comment_handle", "handle"),
+        {"sqlite_with_rowid": False},
     )
 
 
 class CommentURL(Base):
     __tablename__ = "comment_urls"
-    id = Column(Integer, primary_key=True, autoincrement=True)
     comment_id_fk = Column(
-        Integer, ForeignKey("comments.id", ondelete="CASCADE"), nullable=False
+        Integer, ForeignKey("comments.id", ondelete="CASCADE"), primary_key=True
     )
-    url = Column(String(2048), nullable=False)
-    comment = relationship("Comment", back_populates="urls")
+    url = Column(String(2048), primary_key=True)
+    comment = relationship("Comment", back_populates="urls", viewonly=True)
     __table_args__ = (
-        UniqueConstraint("comment_id_fk", "url", name="uq_comment_url"),
         Index("ix_comment_url", "url"),
+        {"sqlite_with_rowid": False},
     )
 
 
-def upsert_comment(session, c: dict[str, Any]) -> Comment:
-    rec: Comment | None = (
-        session.query(Comment)
-        .filter(
-            Comment.owner_id == c["owner_id"],
-            Comment.post_id == c["post_id"],
-            Comment.comment_id == c["comment_id"],
-        )
-        .one_or_none()
-    )
-    is_new = rec is None
-    if is_new:
-        rec = Comment(
-            owner_id=c["owner_id"], post_id=c["post_id"], comment_id=c["comment_id"]
-        )
-        session.add(rec)
+POST_IDS_BY_TMP_KEYS = select(Post.id, Post.owner_id, Post.post_id).join(
+    TMP_POST_KEYS,
+    (Post.owner_id == TMP_POST_KEYS.c.owner_id)
+    & (Post.post_id == TMP_POST_KEYS.c.post_id),
+)
+COMMENT_IDS_BY_TMP_KEYS = select(Comment.id).join(
+    TMP_COMMENT_KEYS,
+    (Comment.owner_id == TMP_COMMENT_KEYS.c.owner_id)
+    & (Comment.post_id == TMP_COMMENT_KEYS.c.post_id)
+    & (Comment.comment_id == TMP_COMMENT_KEYS.c.comment_id),
+)
 
-    if rec.post_row_id is None:
-        post_row = (
-            session.query(Post)
-            .filter(Post.owner_id == c["owner_id"], Post.post_id == c["post_id"])
-            .one_or_none()
-        )
-        if post_row:
-            rec.post_row_id = post_row.id
 
-    rec.from_id = c.get("from_id")
-    rec.author_name = c.get("author_name")
-    rec.reply_to_comment_id = c.get("reply_to_comment_id")
-    rec.date_text = c.get("date_text")
+def fetch_post_id_map(
+    session, post_keys: set[tuple[int, int]]
+) -> dict[tuple[int, int], int]:
+    if not post_keys:
+        return {}
+    fill_temp_table(session, TMP_POST_KEYS, list(post_keys))
+    rows = session.execute(POST_IDS_BY_TMP_KEYS).all()
+    return {(owner_id, post_id): row_id for row_id, owner_id, post_id in rows}
+
+
+def fetch_existing_comment_ids(
+    session, comment_keys: list[tuple[int, int, int]]
+) -> set[int]:
+    if not comment_keys:
+        return set()
+    fill_temp_table(session, TMP_COMMENT_KEYS, comment_keys)
+    return set(session.scalars(COMMENT_IDS_BY_TMP_KEYS))
+
+
+def _comment_row(c: dict[str, Any], key: tuple[int, int, int]) -> dict[str, Any]:
+    row = {
+        "owner_id": key[0],
+        "post_id": key[1],
+        "comment_id": key[2],
+        "post_row_id": None,
+        "from_id": c.get("from_id"),
+        "author_name": c.get("author_name"),
+        "reply_to_comment_id": c.get("reply_to_comment_id"),
+        "date_text": c.get("date_text"),
+        "text": c.get("text"),
+        "is_deleted": c.get("is_deleted"),
+        "is_edited": c.get("is_edited"),
+        "collected_at": c.get("collected_at") or None,
+    }
     if c.get("timestamp") is not None:
-        rec.timestamp = c["timestamp"]
-    rec.text = c.get("text")
-    rec.likes = c.get("likes", rec.likes or 0)
-    rec.is_deleted = c.get("is_deleted")
-    rec.is_edited = c.get("is_edited")
-    rec.collected_at = c.get("collected_at") or rec.collected_at
-
-    if is_new:
-        session.flush()
-    return rec
+        row["timestamp"] = c["timestamp"]
+    if "likes" in c:
+        row["likes"] = c["likes"]
+    return row
+
+
+@lru_cache(maxsize=None)
+def _comment_upsert_stmt(columns: frozenset[str]):
+    stmt = sqlite_insert(Comment)
+    table = Comment.__table__.c
+    set_ = {c: stmt.excluded[c] for c in COMMENT_OVERWRITE_COLS if c in columns}
+    set_["post_row_id"] = func.coalesce(table.post_row_id, stmt.excluded.post_row_id)
+    set_["collected_at"] = func.coalesce(stmt.excluded.collected_at, table.collected_at)
+    return stmt.on_conflict_do_update(
+        index_elements=["owner_id", "post_id", "comment_id"], set_=set_
+    ).returning(Comment.id, Comment.owner_id, Comment.post_id, Comment.comment_id)
+
+
+def upsert_comments(
+    session, rows: list[dict[str, Any]]
+) -> dict[tuple[int, int, int], int]:
+    comment_ids: dict[tuple[int, int, int], int] = {}
+    for group in group_rows_by_columns(rows):
+        stmt = _comment_upsert_stmt(frozenset(group[0]))
+        for row_id, owner_id, post_id, comment_id in session.execute(stmt, group):
+            comment_ids[(owner_id, post_id, comment_id)] = row_id
+    return comment_ids
+
+
+def upsert_comment(session, c: dict[str, Any]) -> int:
+    key = (int(c["owner_id"]), int(c["post_id"]), int(c["comment_id"]))
+    row = _comment_row(c, key)
+    row["post_row_id"] = fetch_post_id_map(session, {key[:2]}).get(key[:2])
+    return upsert_comments(session, [row])[key]
+
+
+COMMENT_CHILD_COLUMNS = {
+    CommentAttachment: ("comment_id_fk", "kind", "href", "src"),
+    CommentHashtag: ("comment_id_fk", "tag"),
+    CommentMention: ("comment_id_fk", "handle"),
+    CommentURL: ("comment_id_fk", "url"),
+}
+COMMENT_ENTITY_MODELS = [CommentHashtag, CommentMention, CommentURL]
+COMMENT_ATTACHMENT_DELETE = (
+    delete(CommentAttachment)
+    .where(CommentAttachment.comment_id_fk.in_(select(TMP_PARENTS.c.id)))
+    .execution_options(synchronize_session=False)
+)
 
 
-def replace_comment_children(session, rec: Comment, c: dict[str, Any]):
-    session.query(CommentAttachment).filter_by(comment_id_fk=rec.id).delete(
-        synchronize_session=False
-    )
-    session.query(CommentHashtag).filter_by(comment_id_fk=rec.id).delete(
-        synchronize_session=False
-    )
-    session.query(CommentMention).filter_by(comment_id_fk=rec.id).delete(
-        synchronize_session=False
-    )
-    session.query(CommentURL).filter_by(comment_id_fk=rec.id).delete(
-        synchronize_session=False
+def replace_comment_children(
+    session, existing_row_ids: list[int], rows: dict[type, list[tuple]]
+):
+    fill_temp_table(session, TMP_PARENTS, [(row_id,) for row_id in existing_row_ids])
+    if existing_row_ids:
+        session.execute(COMMENT_ATTACHMENT_DELETE)
+    insert_many_raw(
+        session,
+        CommentAttachment.__tablename__,
+        COMMENT_CHILD_COLUMNS[CommentAttachment],
+        rows[CommentAttachment],
     )
+    for model in COMMENT_ENTITY_MODELS:
+        sync_child_rows(
+            session, model.__tablename__, COMMENT_CHILD_COLUMNS[model], rows[model]
+        )
+
 
+def collect_comment_children(
+    comment_row_id: int, c: dict[str, Any], rows: dict[type, list[tuple]]
+):
     att = c.get("attachments") or {}
-    for src in att.get("images") or []:
-        session.add(CommentAttachment(comment_id_fk=rec.id, kind="image", src=src))
-    for href in att.get("videos") or []:
-        session.add(CommentAttachment(comment_id_fk=rec.id, kind="video", href=href))
-    for href in att.get("outlinks") or []:
-        session.add(CommentAttachment(comment_id_fk=rec.id, kind="outlink", href=href))
+    rows[CommentAttachment] += (
+        [(comment_row_id, "image", None, src) for src in att.get("images") or []]
+        + [(comment_row_id, "video", href, None) for href in att.get("videos") or []]
+        + [
+            (comment_row_id, "outlink", href, None)
+            for href in att.get("outlinks") or []
+        ]
+    )
 
     tf = c.get("text_features") or {}
+    tags = dict.fromkeys(t.strip().lower() for t in tf.get("hashtags") or [] if t)
+    rows[CommentHashtag].extend((comment_row_id, tag) for tag in tags if tag)
+    rows[CommentMention].extend(
+        (comment_row_id, m) for m in dict.fromkeys(tf.get("mentions") or [])
+    )
+    rows[CommentURL].extend(
+        (comment_row_id, u) for u in dict.fromkeys(tf.get("urls") or [])
+    )
 
-    def _normalize(value: str | None) -> str | None:
-        if value is None:
-            return None
-        value = value.strip().lower()
-        return value or None
-
-    seen_tags: set[str] = set()
-    for raw_tag in tf.get("hashtags") or []:
-        norm = _normalize(raw_tag)
-        if not norm or norm in seen_tags:
-            continue
-        seen_tags.add(norm)
-        session.add(CommentHashtag(comment_id_fk=rec.id, tag=norm))
-    for m in sorted(set(tf.get("mentions") or [])):
-        session.add(CommentMention(comment_id_fk=rec.id, handle=m))
-    for u in sorted(set(tf.get("urls") or [])):
-        session.add(CommentURL(comment_id_fk=rec.id, url=u))
-
-
-def save_comments(comments: list[dict[str, Any]], db_path: str = "vk.sqlite"):
-    session = make_session(db_path)
-    try:
-        deduped: dict[tuple[int, int, int], dict[str, Any]] = {}
-        for c in comments:
-            if not {"owner_id", "post_id", "comment_id"} <= set(c.keys()):
-                continue
+
+def write_comments(session, comments: list[dict[str, Any]]):
+    deduped: dict[tuple[int, int, int], dict[str, Any]] = {}
+    comment_rows: dict[tuple[int, int, int], dict[str, Any]] = {}
+    for c in comments:
+        if "owner_id" in c and "post_id" in c and "comment_id" in c:
             key = (int(c["owner_id"]), int(c["post_id"]), int(c["comment_id"]))
             deduped[key] = c
+            comment_rows[key] = _comment_row(c, key)
+
+    post_keys = {(owner_id, post_id) for owner_id, post_id, _ in deduped}
+    post_id_map = fetch_post_id_map(session, post_keys)
+    for (owner_id, post_id, _), row in comment_rows.items():
+        row["post_row_id"] = post_id_map.get((owner_id, post_id))
+    existing_ids = fetch_existing_comment_ids(session, list(comment_rows))
+    comment_ids = upsert_comments(session, list(comment_rows.values()))
+    rows: dict[type, list[tuple]] = {model: [] for model in COMMENT_CHILD_COLUMNS}
+    for key, c in deduped.items():
+        collect_comment_children(comment_ids[key], c, rows)
+    replace_comment_children(
+        session, [i for i in comment_ids.values() if i in existing_ids], rows
+    )
+
 
-        with session.no_autoflush:
-            for c in deduped.values():
-                rec = upsert_comment(session, c)
-                replace_comment_children(session, rec, c)
-        session.commit()
-    except Exception:
-        session.rollback()
-        raise
-    finally:
-        session.close()
+def save_comments(
+    comments: list[dict[str, Any]],
+    db_path: str = "vk.sqlite",
+    durability: str = "normal",
+    session=None,
+):
+    if session is not None:
+        write_comments(session, comments)
+        return
+    with vk_session(db_path) as session:
+        with batch_transaction(session, len(comments), durability):
+            write_comments(session, comments)
@@ -1,20 +1,233 @@
 import json
-from typing import Any, Dict, Optional
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional
+from sqlalchemy import (
+    Column,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    create_engine,
+    event,
+    inspect,
+    text,
+)
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 Base = declarative_base()
 
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA wal_autocheckpoint=10000",
+    "PRAGMA journal_size_limit=67108864",
+]
+CHECKPOINT_BATCH_SIZE = 5000
+ENGINE_POOL_SIZE = 10
+ENGINE_MAX_OVERFLOW = 20
+ENGINE_POOL_RECYCLE = 1800
+
+REDUNDANT_INDEXES = [
+    "ix_posts_owner_post",
+    "ix_comment_post",
+    "ix_attach_post",
+    "ix_profile_lang_lang",
+    "ix_profiles_user_id",
+    "ix_friend_sample_profile",
+    "ix_follower_sample_profile",
+    "ix_sub_sample_profile",
+    "ix_profile_photo_profile",
+    "ix_video_sample_profile",
+]
+
+temp_metadata = MetaData()
+TMP_PARENTS = Table(
+    "_tmp_parents",
+    temp_metadata,
+    Column("id", Integer, primary_key=True),
+    prefixes=["TEMPORARY"],
+)
+TMP_CHILD_ROWS = Table(
+    "_tmp_child_rows",
+    temp_metadata,
+    Column("parent_id", Integer, primary_key=True),
+    Column("value", String, primary_key=True),
+    prefixes=["TEMPORARY"],
+)
+TMP_POST_KEYS = Table(
+    "_tmp_post_keys",
+    temp_metadata,
+    Column("owner_id", Integer, primary_key=True),
+    Column("post_id", Integer, primary_key=True),
+    prefixes=["TEMPORARY"],
+)
+TMP_COMMENT_KEYS = Table(
+    "_tmp_comment_keys",
+    temp_metadata,
+    Column("owner_id", Integer, primary_key=True),
+    Column("post_id", Integer, primary_key=True),
+    Column("comment_id", Integer, primary_key=True),
+    prefixes=["TEMPORARY"],
+)
+
+
+def _set_sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cur.execute(pragma)
+    cur.close()
+
+
+def _add_missing_columns(conn) -> None:
+    insp = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                backfill = column.info.get("backfill")
+                if backfill is not None:
+                    conn.execute(
+                        text(f"UPDATE {table.name} SET {column.name} = {backfill}")
+                    )
+
+
+def _create_missing_indexes(conn) -> None:
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
 
 def init_db(db_path: str = "vk.sqlite"):
-    eng = create_engine(f"sqlite:///{db_path}", future=True)
+    eng = create_engine(
+        f"sqlite:///{db_path}",
+        future=True,
+        pool_size=ENGINE_POOL_SIZE,
+        max_overflow=ENGINE_MAX_OVERFLOW,
+        pool_recycle=ENGINE_POOL_RECYCLE,
+    )
+    event.listen(eng, "connect", _set_sqlite_pragmas)
     Base.metadata.create_all(eng)
+    with eng.begin() as conn:
+        _add_missing_columns(conn)
+        _create_missing_indexes(conn)
+        for name in REDUNDANT_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
     return eng
 
 
+@lru_cache(maxsize=None)
+def _get_engine(db_path: str):
+    return init_db(db_path)
+
+
+@lru_cache(maxsize=None)
+def _get_session_factory(db_path: str):
+    return sessionmaker(bind=_get_engine(db_path), future=True)
+
+
 def make_session(db_path: str = "vk_posts.sqlite"):
-    eng = init_db(db_path)
-    return sessionmaker(bind=eng, future=True)()
+    return _get_session_factory(db_path)()
+
+
+@contextmanager
+def vk_session(db_path: str = "vk.sqlite"):
+    session = make_session(db_path)
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@contextmanager
+def deferred_indexes(db_path: str, indexes: Iterable[Index]):
+    eng = _get_engine(db_path)
+    indexes = list(indexes)
+    for index in indexes:
+        index.drop(eng, checkfirst=True)
+    try:
+        yield
+    finally:
+        for index in indexes:
+            index.create(eng, checkfirst=True)
+
+
+def set_synchronous(session, mode: str):
+    session.execute(text(f"PRAGMA synchronous={mode}"))
+
+
+def finish_batch(session, batch_size: int):
+    session.execute(text("PRAGMA optimize"))
+    if batch_size >= CHECKPOINT_BATCH_SIZE:
+        session.execute(text("PRAGMA wal_checkpoint(PASSIVE)"))
+
+
+@contextmanager
+def batch_transaction(session, batch_size: int, durability: str = "normal"):
+    fast = durability == "fast"
+    try:
+        with session.begin():
+            if fast:
+                set_synchronous(session, "OFF")
+            yield session
+    finally:
+        if fast:
+            set_synchronous(session, "NORMAL")
+    finish_batch(session, batch_size)
+
+
+def insert_many_raw(session, table: str, columns: Iterable[str], rows: List[tuple]):
+    columns = list(columns)
+    sql = (
+        f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' * len(columns))})"
+    )
+    session.connection().connection.executemany(sql, rows)
+
+
+def fill_temp_table(session, table: Table, rows: List[tuple]):
+    conn = session.connection()
+    table.create(conn, checkfirst=True)
+    conn.execute(table.delete())
+    insert_many_raw(session, table.name, table.c.keys(), rows)
+
+
+@lru_cache(maxsize=None)
+def _sync_child_sql(table: str, parent: str, value: str):
+    delete_stale = text(
+        f"DELETE FROM {table} WHERE {parent} IN (SELECT id FROM _tmp_parents) "
+        f"AND NOT EXISTS (SELECT 1 FROM _tmp_child_rows t "
+        f"WHERE t.parent_id = {table}.{parent} AND t.value = {table}.{value})"
+    )
+    insert_new = text(
+        f"INSERT OR IGNORE INTO {table} ({parent}, {value}) "
+        f"SELECT parent_id, value FROM _tmp_child_rows"
+    )
+    return delete_stale, insert_new
+
+
+def sync_child_rows(session, table: str, columns: Iterable[str], rows: List[tuple]):
+    fill_temp_table(session, TMP_CHILD_ROWS, rows)
+    for stmt in _sync_child_sql(table, *columns):
+        session.execute(stmt)
+
+
+def group_rows_by_columns(
+    rows: Iterable[Dict[str, Any]],
+) -> List[List[Dict[str, Any]]]:
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for row in rows:
+        groups.setdefault(tuple(row), []).append(row)
+    return list(groups.values())
 
 
 def json_or_none(obj: Optional[Dict[str, Any]]) -> Optional[str]:
@@ -1,4 +1,6 @@
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from sqlalchemy import (
     Column,
     ForeignKey,
@@ -8,10 +10,27 @@ from sqlalchemy import (
     Boolean,
     Index,
     UniqueConstraint,
+    delete,
+    func,
+    select,
 )
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import relationship
 
-from storage.models import Base, make_session
+from storage.models import (
+    TMP_PARENTS,
+    Base,
+    batch_transaction,
+    fill_temp_table,
+    group_rows_by_columns,
+    insert_many_raw,
+    sync_child_rows,
+    vk_session,
+)
+
+POST_COUNTER_COLS = ["likes", "reposts", "comments", "views"]
+POST_OVERWRITE_COLS = ["timestamp", "text", *POST_COUNTER_COLS]
+POST_KEEP_COLS = ["url", "date_text", "pinned", "is_comments_closed", "collected_at"]
 
 
 class Post(Base):
@@ -39,19 +58,20 @@ class Post(Base):
     collected_at = Column(Integer, nullable=True)
 
     attachments = relationship(
-        "PostAttachment", cascade="all, delete-orphan", back_populates="post"
+        "PostAttachment", lazy="selectin", viewonly=True, back_populates="post"
     )
     hashtags = relationship(
-        "PostHashtag", cascade="all, delete-orphan", back_populates="post"
+        "PostHashtag", lazy="selectin", viewonly=True, back_populates="post"
     )
     mentions = relationship(
-        "PostMention", cascade="all, delete-orphan", back_populates="post"
+        "PostMention", lazy="selectin", viewonly=True, back_populates="post"
+    )
+    urls = relationship(
+        "PostURL", lazy="selectin", viewonly=True, back_populates="post"
     )
-    urls = relationship("PostURL", cascade="all, delete-orphan", back_populates="post")
 
     __table_args__ = (
         UniqueConstraint("owner_id", "post_id", name="uq_posts_owner_post"),
-        Index("ix_posts_owner_post", "owner_id", "post_id"),
         Index("ix_posts_timestamp", "timestamp"),
     )
 
@@ -69,156 +89,223 @@ class PostAttachment(Base):
     src = Column(String(1024))
     extra_json = Column(Text)
 
-    post = relationship("Post", back_populates="attachments")
+    post = relationship("Post", back_populates="attachments", viewonly=True)
 
     __table_args__ = (
         UniqueConstraint("post_id", "kind", "href", "src", name="uq_attachment_dedup"),
-        Index("ix_attach_post", "post_id"),
         Index("ix_attach_kind", "kind"),
     )
 
 
 class PostHashtag(Base):
     __tablename__ = "post_hashtags"
-    id = Column(Integer, primary_key=True, autoincrement=True)
     post_id = Column(
-        Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False
+        Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True
     )
-    tag = Column(String(128), nullable=False)
+    tag = Column(String(128), primary_key=True)
 
-    post = relationship("Post", back_populates="hashtags")
+    post = relationship("Post", back_populates="hashtags", viewonly=True)
 
     __table_args__ = (
-        UniqueConstraint("post_id", "tag", name="uq_post_tag"),
         Index("ix_hashtag_tag", "tag"),
+        {"sqlite_with_rowid": False},
     )
 
 
 class PostMention(Base):
     __tablename__ = "post_mentions"
-    id = Column(Integer, primary_key=True, autoincrement=True)
     post_id = Column(
-        Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False
+        Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True
     )
-    handle = Column(String(128), nullable=False)
+    handle = Column(String(128), primary_key=True)
 
-    post = relationship("Post", back_populates="mentions")
+    post = relationship("Post", back_populates="mentions", viewonly=True)
 
     __table_args__ = (
-        UniqueConstraint("post_id", "handle", name="uq_post_handle"),
         Index("ix_mention_handle", "handle"),
+        {"sqlite_with_rowid": False},
     )
 
 
 class PostURL(Base):
     __tablename__ = "post_urls"
-    id = Column(Integer, primary_key=True, autoincrement=True)
     post_id = Column(
-        Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False
+        Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True
     )
-    url = Column(String(2048), nullable=False)
+    url = Column(String(2048), primary_key=True)
 
-    post = relationship("Post", back_populates="urls")
+    post = relationship("Post", back_populates="urls", viewonly=True)
 
     __table_args__ = (
-        UniqueConstraint("post_id", "url", name="uq_post_url"),
         Index("ix_url_url", "url"),
+        {"sqlite_with_rowid": False},
     )
 
 
-def upsert_post(session, p: Dict[str, Any]) -> Post:
-    owner_id, post_id = p["owner_id"], p["post_id"]
-    rec: Optional[Post] = (
-        session.query(Post)
-        .filter(Post.owner_id == owner_id, Post.post_id == post_id)
-        .one_or_none()
-    )
-    is_new = rec is None
-    if is_new:
-        rec = Post(owner_id=owner_id, post_id=post_id)
-        session.add(rec)
-
-    rec.url = p.get("url") or rec.url
-    rec.date_text = p.get("date_text") or rec.date_text
+def _post_row(p: Dict[str, Any]) -> Dict[str, Any]:
+    flg = p.get("flags") or {}
+    row = {
+        "owner_id": p["owner_id"],
+        "post_id": p["post_id"],
+        "url": p.get("url") or None,
+        "date_text": p.get("date_text") or None,
+        "pinned": flg.get("pinned"),
+        "is_comments_closed": flg.get("is_comments_closed"),
+        "collected_at": p.get("collected_at") or None,
+    }
     if p.get("timestamp"):
-        rec.timestamp = p["timestamp"]
+        row["timestamp"] = p["timestamp"]
     if "text" in p:
-        rec.text = p["text"]
+        row["text"] = p["text"]
     ctr = p.get("counters") or {}
-    rec.likes = ctr.get("likes", rec.likes or 0)
-    rec.reposts = ctr.get("reposts", rec.reposts or 0)
-    rec.comments = ctr.get("comments", rec.comments or 0)
-    rec.views = ctr.get("views", rec.views or 0)
-    flg = p.get("flags") or {}
-    if "pinned" in flg and flg["pinned"] is not None:
-        rec.pinned = flg["pinned"]
-    if "is_comments_closed" in flg and flg["is_comments_closed"] is not None:
-        rec.is_comments_closed = flg["is_comments_closed"]
-    if "collected_at" in p and p["collected_at"]:
-        rec.collected_at = p["collected_at"]
-
-    if is_new:
-        session.flush()
-    return rec
+    row.update({k: ctr[k] for k in POST_COUNTER_COLS if k in ctr})
+    return row
+
+
+POST_CHILD_COLUMNS = {
+    PostAttachment: ("post_id", "kind", "href", "src"),
+    PostHashtag: ("post_id", "tag"),
+    PostMention: ("post_id", "handle"),
+    PostURL: ("post_id", "url"),
+}
+POST_ENTITY_MODELS = [PostHashtag, PostMention, PostURL]
+POST_ATTACHMENT_DELETE = (
+    delete(PostAttachment)
+    .where(PostAttachment.post_id.in_(select(TMP_PARENTS.c.id)))
+    .execution_options(synchronize_session=False)
+)
 
 
-def replace_children(session, rec: Post, p: Dict[str, Any]):
-    session.query(PostAttachment).filter_by(post_id=rec.id).delete(
-        synchronize_session=False
+@lru_cache(maxsize=None)
+def _post_upsert_stmt(columns: frozenset[str]):
+    stmt = sqlite_insert(Post)
+    set_ = {c: stmt.excluded[c] for c in POST_OVERWRITE_COLS if c in columns}
+    set_.update(
+        {
+            c: func.coalesce(stmt.excluded[c], Post.__table__.c[c])
+            for c in POST_KEEP_COLS
+        }
     )
-    session.query(PostHashtag).filter_by(post_id=rec.id).delete(
-        synchronize_session=False
+    return stmt.on_conflict_do_update(
+        index_elements=["owner_id", "post_id"], set_=set_
+    ).returning(Post.id, Post.owner_id, Post.post_id)
+
+
+def upsert_posts(
+    session, post_rows: List[Dict[str, Any]]
+) -> Dict[tuple[int, int], int]:
+    post_ids: Dict[tuple[int, int], int] = {}
+    for rows in group_rows_by_columns(post_rows):
+        stmt = _post_upsert_stmt(frozenset(rows[0]))
+        for row_id, owner_id, post_id in session.execute(stmt, rows):
+            post_ids[(owner_id, post_id)] = row_id
+    return post_ids
+
+
+def upsert_post(session, p: Dict[str, Any]) -> int:
+    post_ids = upsert_posts(session, [_post_row(p)])
+    return next(iter(post_ids.values()))
+
+
+def replace_children(session, post_row_ids: List[int], rows: Dict[type, List[tuple]]):
+    fill_temp_table(session, TMP_PARENTS, [(row_id,) for row_id in post_row_ids])
+    session.execute(POST_ATTACHMENT_DELETE)
+    insert_many_raw(
+        session,
+        PostAttachment.__tablename__,
+        POST_CHILD_COLUMNS[PostAttachment],
+        rows[PostAttachment],
     )
-    session.query(PostMention).filter_by(post_id=rec.id).delete(
-        synchronize_session=False
-    )
-    session.query(PostURL).filter_by(post_id=rec.id).delete(synchronize_session=False)
+    for model in POST_ENTITY_MODELS:
+        sync_child_rows(
+            session, model.__tablename__, POST_CHILD_COLUMNS[model], rows[model]
+        )
 
+
+def _post_children(p: Dict[str, Any]) -> Dict[type, List[tuple]]:
     att = p.get("attachments") or {}
-    imgs = att.get("images") or []
-    vids = att.get("videos") or []
-    outs = att.get("outlinks") or []
-
-    for src in imgs:
-        session.add(
-            PostAttachment(
-                post_id=rec.id, kind="image", src=src, href=None, extra_json=None
-            )
-        )
-    for href in vids:
-        session.add(
-            PostAttachment(
-                post_id=rec.id, kind="video", href=href, src=None, extra_json=None
-            )
-        )
-    for href in outs:
-        session.add(
-            PostAttachment(
-                post_id=rec.id, kind="outlink", href=href, src=None, extra_json=None
-            )
-        )
+    attachments = (
+        [("image", None, src) for src in att.get("images") or []]
+        + [("video", href, None) for href in att.get("videos") or []]
+        + [("outlink", href, None) for href in att.get("outlinks") or []]
+    )
 
     tf = p.get("text_features") or {}
-    for tag in set([t.lower() for t in (tf.get("hashtags") or [])]):
-        session.add(PostHashtag(post_id=rec.id, tag=tag))
-    for h in set([m for m in (tf.get("mentions") or [])]):
-        session.add(PostMention(post_id=rec.id, handle=h))
-    for u in set([u for u in (tf.get("urls") or [])]):
-        session.add(PostURL(post_id=rec.id, url=u))
-
-
-def save_posts(posts: List[Dict[str, Any]], db_path: str = "vk.sqlite"):
-    session = make_session(db_path)
-    try:
-        with session.no_autoflush:
-            for p in posts:
-                if "owner_id" not in p or "post_id" not in p:
-                    continue
-                rec = upsert_post(session, p)
-                replace_children(session, rec, p)
-        session.commit()
-    except Exception:
-        session.rollback()
-        raise
-    finally:
-        session.close()
+    return {
+        PostAttachment: attachments,
+        PostHashtag: [
+            (tag,) for tag in dict.fromkeys(t.lower() for t in tf.get("hashtags") or [])
+        ],
+        PostMention: [(h,) for h in dict.fromkeys(tf.get("mentions") or [])],
+        PostURL: [(u,) for u in dict.fromkeys(tf.get("urls") or [])],
+    }
+
+
+def prepare_posts(
+    posts: List[Dict[str, Any]],
+) -> List[Tuple[Dict[str, Any], Dict[type, List[tuple]]]]:
+    return _collapse_prepared(
+        (_post_row(p), _post_children(p))
+        for p in posts
+        if "owner_id" in p and "post_id" in p
+    )
+
+
+def _collapse_prepared(
+    prepared: Iterable[Tuple[Dict[str, Any], Dict[type, List[tuple]]]],
+) -> List[Tuple[Dict[str, Any], Dict[type, List[tuple]]]]:
+    latest: Dict[tuple, Tuple[Dict[str, Any], Dict[type, List[tuple]]]] = {}
+    for row, children in prepared:
+        latest[(row["owner_id"], row["post_id"])] = (row, children)
+    return list(latest.values())
+
+
+def write_posts(
+    session, prepared: List[Tuple[Dict[str, Any], Dict[type, List[tuple]]]]
+):
+    post_ids = upsert_posts(session, [row for row, _ in prepared])
+    rows: Dict[type, List[tuple]] = {model: [] for model in POST_CHILD_COLUMNS}
+    for row, children in prepared:
+        post_row_id = post_ids[(row["owner_id"], row["post_id"])]
+        for model, items in children.items():
+            rows[model].extend((post_row_id, *item) for item in items)
+    replace_children(session, list(post_ids.values()), rows)
+
+
+def _save_prepared_posts(
+    prepared: List[Tuple[Dict[str, Any], Dict[type, List[tuple]]]],
+    db_path: str,
+    durability: str,
+    session=None,
+):
+    if session is not None:
+        write_posts(session, prepared)
+        return
+    with vk_session(db_path) as session:
+        with batch_transaction(session, len(prepared), durability):
+            write_posts(session, prepared)
+
+
+def save_posts(
+    posts: List[Dict[str, Any]],
+    db_path: str = "vk.sqlite",
+    durability: str = "normal",
+    session=None,
+):
+    _save_prepared_posts(prepare_posts(posts), db_path, durability, session)
+
+
+def save_posts_parallel(
+    posts: List[Dict[str, Any]],
+    db_path: str = "vk.sqlite",
+    durability: str = "normal",
+    max_workers: Optional[int] = None,
+    chunk_size: int = 1000,
+    session=None,
+):
+    chunks = [posts[i : i + chunk_size] for i in range(0, len(posts), chunk_size)]
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        prepared = _collapse_prepared(
+            item for part in ex.map(prepare_posts, chunks) for item in part
+        )
+    _save_prepared_posts(prepared, db_path, durability, session)
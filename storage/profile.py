@@ -1,4 +1,7 @@
+import json
+import logging
 import time
+from functools import lru_cache
 from typing import Any
 from sqlalchemy import (
     Boolean,
@@ -10,10 +13,35 @@ from sqlalchemy import (
     Text,
     Date,
     UniqueConstraint,
+    bindparam,
+    delete,
+    event,
+    insert,
+    inspect,
+    select,
+    text,
+    update,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import relationship, selectinload
+
+from storage.models import (
+    Base,
+    deferred_indexes,
+    group_rows_by_columns,
+    make_session,
+)
+
+LOGGER_NAME = "vk_crawler.storage.profile"
+_log = logging.getLogger(LOGGER_NAME)
 
-from storage.models import Base, make_session
+
+def _counter_backfill(counter: str) -> str:
+    return (
+        f"(SELECT {counter} FROM profile_counters "
+        f"WHERE profile_counters.profile_id = profiles.id)"
+    )
 
 
 class Profile(Base):
@@ -47,37 +75,20 @@ class Profile(Base):
     no_index = Column(String(64), nullable=True)
     wall_default = Column(String(16), nullable=True)
 
-    status = Column(Text, nullable=True)
-    activity = Column(Text, nullable=True)
-    about = Column(Text, nullable=True)
-    interests = Column(Text, nullable=True)
-    books = Column(Text, nullable=True)
-    tv = Column(Text, nullable=True)
-    quotes = Column(Text, nullable=True)
-    games = Column(Text, nullable=True)
-    movies = Column(Text, nullable=True)
-    music = Column(Text, nullable=True)
-
-    site = Column(String(1024), nullable=True)
-    mobile_phone = Column(String(64), nullable=True)
-    home_phone = Column(String(64), nullable=True)
-
-    photo_50 = Column(String(1024), nullable=True)
-    photo_100 = Column(String(1024), nullable=True)
-    photo_200 = Column(String(1024), nullable=True)
-    photo_400 = Column(String(1024), nullable=True)
-    photo_max = Column(String(1024), nullable=True)
-    photo_base = Column(String(1024), nullable=True)
-    photo_avg_color = Column(String(16), nullable=True)
-    photo_id = Column(String(64), nullable=True)
-
-    cover_photo_url = Column(String(1024), nullable=True)
-
     online = Column(Boolean, nullable=True)
     last_seen_ts = Column(Integer, nullable=True)
     last_seen_platform = Column(Integer, nullable=True)
     online_app_id = Column(Integer, nullable=True)
     followers_count = Column(Integer, nullable=True)
+    friends_count = Column(
+        Integer, nullable=True, info={"backfill": _counter_backfill("friends")}
+    )
+    groups_count = Column(
+        Integer, nullable=True, info={"backfill": _counter_backfill("groups")}
+    )
+    photos_count = Column(
+        Integer, nullable=True, info={"backfill": _counter_backfill("photos")}
+    )
 
     collected_at = Column(Integer, nullable=True)
     updated_at = Column(Integer, nullable=True)
@@ -111,9 +122,6 @@ class Profile(Base):
         "ProfileCareer", cascade="all, delete-orphan", back_populates="profile"
     )
 
-    friends_sample = relationship(
-        "ProfileFriendSample", cascade="all, delete-orphan", back_populates="profile"
-    )
     followers_sample = relationship(
         "ProfileFollowerSample", cascade="all, delete-orphan", back_populates="profile"
     )
@@ -129,10 +137,29 @@ class Profile(Base):
     videos_sample = relationship(
         "ProfileVideoSample", cascade="all, delete-orphan", back_populates="profile"
     )
+    texts = relationship(
+        "ProfileText",
+        uselist=False,
+        cascade="all, delete-orphan",
+        lazy="noload",
+        back_populates="profile",
+    )
+    extra = relationship(
+        "ProfileExtra",
+        uselist=False,
+        cascade="all, delete-orphan",
+        lazy="noload",
+        back_populates="profile",
+    )
 
     __table_args__ = (
-        Index("ix_profiles_user_id", "user_id"),
         Index("ix_profiles_screen_name", "screen_name"),
+        Index(
+            "ix_profiles_unclassified",
+            "updated_at",
+            sqlite_where=text("is_bot IS NULL"),
+        ),
+        Index("ix_profiles_stale", "updated_at"),
     )
 
 
@@ -186,6 +213,126 @@ class ProfilePersonal(Base):
     __table_args__ = (UniqueConstraint("profile_id", name="uq_profile_personal_one"),)
 
 
+class ProfileText(Base):
+    __tablename__ = "profile_texts"
+
+    profile_id = Column(
+        Integer, ForeignKey("profiles.id", ondelete="CASCADE"), primary_key=True
+    )
+
+    status = Column(Text, nullable=True)
+    activity = Column(Text, nullable=True)
+    about = Column(Text, nullable=True)
+    interests = Column(Text, nullable=True)
+    books = Column(Text, nullable=True)
+    tv = Column(Text, nullable=True)
+    quotes = Column(Text, nullable=True)
+    games = Column(Text, nullable=True)
+    movies = Column(Text, nullable=True)
+    music = Column(Text, nullable=True)
+
+    profile = relationship("Profile", back_populates="texts")
+
+
+class ProfileExtra(Base):
+    __tablename__ = "profile_extras"
+
+    profile_id = Column(
+        Integer, ForeignKey("profiles.id", ondelete="CASCADE"), primary_key=True
+    )
+
+    site = Column(String(1024), nullable=True)
+    mobile_phone = Column(String(64), nullable=True)
+    home_phone = Column(String(64), nullable=True)
+
+    photo_50 = Column(String(1024), nullable=True)
+    photo_100 = Column(String(1024), nullable=True)
+    photo_200 = Column(String(1024), nullable=True)
+    photo_400 = Column(String(1024), nullable=True)
+    photo_max = Column(String(1024), nullable=True)
+    photo_base = Column(String(1024), nullable=True)
+    photo_avg_color = Column(String(16), nullable=True)
+    photo_id = Column(String(64), nullable=True)
+
+    cover_photo_url = Column(String(1024), nullable=True)
+
+    friends_sample_json = Column(Text, nullable=True)
+
+    profile = relationship("Profile", back_populates="extra")
+
+
+PROFILE_SIDE_COLUMNS = {
+    model: [c.name for c in model.__table__.columns if c.name != "profile_id"]
+    for model in (ProfileText, ProfileExtra)
+}
+PROFILE_SIDE_COLS = {c for cols in PROFILE_SIDE_COLUMNS.values() for c in cols}
+
+
+def _move_profile_columns(target, connection, **kw) -> None:
+    existing = {c["name"] for c in inspect(connection).get_columns("profiles")}
+    cols = [c.name for c in target.columns if c.name != "profile_id"]
+    cols = [c for c in cols if c in existing]
+    if not cols:
+        return
+    names = ", ".join(cols)
+    connection.execute(
+        text(
+            f"INSERT INTO {target.name} (profile_id, {names}) "
+            f"SELECT id, {names} FROM profiles"
+        )
+    )
+    for c in cols:
+        connection.execute(text(f"ALTER TABLE profiles DROP COLUMN {c}"))
+
+
+for _model in PROFILE_SIDE_COLUMNS:
+    event.listen(_model.__table__, "after_create", _move_profile_columns)
+
+
+FRIENDS_SAMPLE_KEYS = (
+    "friend_user_id",
+    "domain",
+    "first_name",
+    "last_name",
+    "sex",
+    "online",
+    "photo_50",
+    "photo_100",
+    "photo_200",
+)
+FRIENDS_SAMPLE_JSON = ", ".join(
+    (
+        f"'{k}', CASE WHEN online THEN json('true') ELSE json('false') END"
+        if k == "online"
+        else f"'{k}', {k}"
+    )
+    for k in FRIENDS_SAMPLE_KEYS
+)
+FRIENDS_SAMPLE_MIGRATE = text(
+    "INSERT INTO profile_extras (profile_id, friends_sample_json) "
+    f"SELECT profile_id, json_group_array(json_object({FRIENDS_SAMPLE_JSON})) "
+    "FROM profile_friends_sample GROUP BY profile_id "
+    "ON CONFLICT (profile_id) DO UPDATE "
+    "SET friends_sample_json = excluded.friends_sample_json"
+)
+
+
+def _move_friends_sample(target, connection, **kw) -> None:
+    insp = inspect(connection)
+    if not insp.has_table("profile_friends_sample"):
+        return
+    existing = {c["name"] for c in insp.get_columns("profile_extras")}
+    if "friends_sample_json" not in existing:
+        connection.execute(
+            text("ALTER TABLE profile_extras ADD COLUMN friends_sample_json TEXT")
+        )
+    connection.execute(FRIENDS_SAMPLE_MIGRATE)
+    connection.execute(text("DROP TABLE profile_friends_sample"))
+
+
+event.listen(Base.metadata, "after_create", _move_friends_sample)
+
+
 class ProfileLanguage(Base):
     __tablename__ = "profile_languages"
 
@@ -197,10 +344,7 @@ class ProfileLanguage(Base):
 
     profile = relationship("Profile", back_populates="languages")
 
-    __table_args__ = (
-        UniqueConstraint("profile_id", "lang", name="uq_profile_lang"),
-        Index("ix_profile_lang_lang", "lang"),
-    )
+    __table_args__ = (UniqueConstraint("profile_id", "lang", name="uq_profile_lang"),)
 
 
 class ProfileUniversity(Base):
@@ -265,32 +409,6 @@ class ProfileCareer(Base):
     __table_args__ = (Index("ix_career_profile", "profile_id"),)
 
 
-class ProfileFriendSample(Base):
-    __tablename__ = "profile_friends_sample"
-
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    profile_id = Column(
-        Integer, ForeignKey("profiles.id", ondelete="CASCADE"), nullable=False
-    )
-
-    friend_user_id = Column(Integer, nullable=False)
-    domain = Column(String(255), nullable=True)
-    first_name = Column(String(255), nullable=True)
-    last_name = Column(String(255), nullable=True)
-    sex = Column(Integer, nullable=True)
-    online = Column(Boolean, nullable=True)
-    photo_50 = Column(String(1024), nullable=True)
-    photo_100 = Column(String(1024), nullable=True)
-    photo_200 = Column(String(1024), nullable=True)
-
-    profile = relationship("Profile", back_populates="friends_sample")
-
-    __table_args__ = (
-        UniqueConstraint("profile_id", "friend_user_id", name="uq_friend_sample"),
-        Index("ix_friend_sample_profile", "profile_id"),
-    )
-
-
 class ProfileFollowerSample(Base):
     __tablename__ = "profile_followers_sample"
 
@@ -312,7 +430,6 @@ class ProfileFollowerSample(Base):
 
     __table_args__ = (
         UniqueConstraint("profile_id", "follower_user_id", name="uq_follower_sample"),
-        Index("ix_follower_sample_profile", "profile_id"),
     )
 
 
@@ -335,10 +452,7 @@ class ProfileSubscriptionSample(Base):
 
     profile = relationship("Profile", back_populates="subscriptions_sample")
 
-    __table_args__ = (
-        UniqueConstraint("profile_id", "group_id", name="uq_sub_sample"),
-        Index("ix_sub_sample_profile", "profile_id"),
-    )
+    __table_args__ = (UniqueConstraint("profile_id", "group_id", name="uq_sub_sample"),)
 
 
 class ProfilePhoto(Base):
@@ -362,7 +476,6 @@ class ProfilePhoto(Base):
 
     __table_args__ = (
         UniqueConstraint("profile_id", "photo_id", name="uq_profile_photo"),
-        Index("ix_profile_photo_profile", "profile_id"),
     )
 
 
@@ -394,148 +507,283 @@ class ProfileVideoSample(Base):
 
     __table_args__ = (
         UniqueConstraint("profile_id", "owner_id", "video_id", name="uq_video_sample"),
-        Index("ix_video_sample_profile", "profile_id"),
     )
 
 
-def upsert_profile(session, p: dict[str, Any]) -> Profile:
-    user_id = p["user_id"]
-    rec: Profile | None = (
-        session.query(Profile).filter(Profile.user_id == user_id).one_or_none()
-    )
-    is_new = rec is None
-    if is_new:
-        rec = Profile(user_id=user_id)
-        session.add(rec)
-
-    for k, v in p.items():
-        if k == "user_id":
-            continue
-        setattr(rec, k, v)
-
-    rec.updated_at = int(time.time())
-    if is_new:
-        session.flush()
-    return rec
-
-
-def replace_profile_children(session, profile: Profile, bundle: dict[str, Any]) -> None:
-    session.query(ProfileCounters).filter_by(profile_id=profile.id).delete(
-        synchronize_session=False
-    )
-    session.query(ProfilePersonal).filter_by(profile_id=profile.id).delete(
-        synchronize_session=False
-    )
-    session.query(ProfileLanguage).filter_by(profile_id=profile.id).delete(
-        synchronize_session=False
-    )
-    session.query(ProfileUniversity).filter_by(profile_id=profile.id).delete(
-        synchronize_session=False
-    )
-    session.query(ProfileSchool).filter_by(profile_id=profile.id).delete(
-        synchronize_session=False
-    )
-    session.query(ProfileCareer).filter_by(profile_id=profile.id).delete(
-        synchronize_session=False
-    )
-    session.query(ProfileFriendSample).filter_by(profile_id=profile.id).delete(
-        synchronize_session=False
-    )
-    session.query(ProfileFollowerSample).filter_by(profile_id=profile.id).delete(
-        synchronize_session=False
-    )
-    session.query(ProfileSubscriptionSample).filter_by(profile_id=profile.id).delete(
-        synchronize_session=False
-    )
-    session.query(ProfilePhoto).filter_by(profile_id=profile.id).delete(
-        synchronize_session=False
-    )
-    session.query(ProfileVideoSample).filter_by(profile_id=profile.id).delete(
-        synchronize_session=False
-    )
+PROFILE_CHILD_MODELS = [
+    ProfileCounters,
+    ProfilePersonal,
+    ProfileLanguage,
+    ProfileUniversity,
+    ProfileSchool,
+    ProfileCareer,
+    ProfileFollowerSample,
+    ProfileSubscriptionSample,
+    ProfilePhoto,
+    ProfileVideoSample,
+]
+PROFILE_DENORM_COUNTERS = {
+    "friends_count": "friends",
+    "groups_count": "groups",
+    "photos_count": "photos",
+}
+PROFILE_COUNTERS_UPDATE = (
+    update(Profile)
+    .where(Profile.id == bindparam("profile_id"))
+    .values({col: bindparam(col) for col in PROFILE_DENORM_COUNTERS})
+    .execution_options(synchronize_session=False)
+)
+PROFILE_SAMPLE_SPECS = [
+    (ProfileFollowerSample, ("follower_user_id",), "followers_sample"),
+    (ProfileSubscriptionSample, ("group_id",), "subscriptions_sample"),
+    (ProfilePhoto, ("photo_id",), "photos"),
+    (ProfileVideoSample, ("owner_id", "video_id"), "videos_sample"),
+]
+PROFILE_SAMPLE_MODELS = [model for model, _, _ in PROFILE_SAMPLE_SPECS]
+PROFILE_DEFERRED_INDEXES = [
+    index
+    for index in Profile.__table__.indexes
+    if index.name
+    in ("ix_profiles_screen_name", "ix_profiles_unclassified", "ix_profiles_stale")
+]
+PROFILE_REPLACED_MODELS = [
+    model for model in PROFILE_CHILD_MODELS if model not in PROFILE_SAMPLE_MODELS
+]
+PROFILE_CHILD_DELETE_SQL = [
+    f"DELETE FROM {model.__tablename__} WHERE profile_id = ?"
+    for model in PROFILE_REPLACED_MODELS
+]
+PROFILE_CHILD_INSERTS = {
+    model: insert(model.__table__) for model in PROFILE_REPLACED_MODELS
+}
+
+
+def _sample_upsert_stmt(model, key_cols: tuple[str, ...]):
+    table = model.__table__
+    conflict_cols = ("profile_id", *key_cols)
+    stmt = sqlite_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=list(conflict_cols),
+        set_={
+            c.name: stmt.excluded[c.name]
+            for c in table.columns
+            if not c.primary_key and c.name not in conflict_cols
+        },
+    )
+
+
+PROFILE_SAMPLE_UPSERTS = {
+    model: _sample_upsert_stmt(model, key_cols)
+    for model, key_cols, _ in PROFILE_SAMPLE_SPECS
+}
+PROFILE_SAMPLE_EXISTING = {
+    model: select(model.id, *(model.__table__.c[c] for c in key_cols)).where(
+        model.profile_id == bindparam("profile_id")
+    )
+    for model, key_cols, _ in PROFILE_SAMPLE_SPECS
+}
+PROFILE_SAMPLE_DELETES = {
+    model: delete(model)
+    .where(model.id.in_(bindparam("ids", expanding=True)))
+    .execution_options(synchronize_session=False)
+    for model in PROFILE_SAMPLE_MODELS
+}
+
+
+@lru_cache(maxsize=None)
+def _profile_upsert_stmt(columns: frozenset[str]):
+    stmt = sqlite_insert(Profile)
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={c: stmt.excluded[c] for c in columns if c != "user_id"},
+    ).returning(Profile.id)
+
+
+@lru_cache(maxsize=None)
+def _profile_side_upsert_stmt(model, columns: frozenset[str]):
+    stmt = sqlite_insert(model)
+    return stmt.on_conflict_do_update(
+        index_elements=["profile_id"],
+        set_={c: stmt.excluded[c] for c in columns},
+    )
+
+
+def upsert_profile(session, p: dict[str, Any], now: int | None = None) -> int:
+    row = {k: v for k, v in p.items() if k not in PROFILE_SIDE_COLS}
+    row["updated_at"] = now or int(time.time())
+    return session.execute(_profile_upsert_stmt(frozenset(row)), row).scalar_one()
+
+
+def replace_profile_children(session, profile_id: int, bundle: dict[str, Any]) -> None:
+    dbapi_conn = session.connection().connection
+    for sql in PROFILE_CHILD_DELETE_SQL:
+        dbapi_conn.execute(sql, (profile_id,))
+
+    rows: dict[type, list[dict[str, Any]]] = {
+        model: [] for model in PROFILE_REPLACED_MODELS
+    }
+
+    prof = bundle.get("profile") or {}
+    side_rows = {
+        model: {c: prof[c] for c in cols if c in prof}
+        for model, cols in PROFILE_SIDE_COLUMNS.items()
+    }
+    side_rows[ProfileExtra]["friends_sample_json"] = json.dumps(
+        bundle.get("friends_sample") or [], ensure_ascii=False
+    )
+    for model, values in side_rows.items():
+        if values:
+            session.execute(
+                _profile_side_upsert_stmt(model, frozenset(values)),
+                {"profile_id": profile_id, **values},
+            )
 
     cnt = bundle.get("counters") or {}
     if cnt:
-        session.add(ProfileCounters(profile_id=profile.id, **cnt))
+        rows[ProfileCounters].append({"profile_id": profile_id, **cnt})
+    session.execute(
+        PROFILE_COUNTERS_UPDATE,
+        {
+            "profile_id": profile_id,
+            **{col: cnt.get(key) for col, key in PROFILE_DENORM_COUNTERS.items()},
+        },
+    )
 
     pers = bundle.get("personal") or {}
     if pers:
-        session.add(ProfilePersonal(profile_id=profile.id, **pers))
-
-    for lang in set(bundle.get("languages") or []):
-        if not lang:
+        rows[ProfilePersonal].append({"profile_id": profile_id, **pers})
+
+    rows[ProfileLanguage] = [
+        {"profile_id": profile_id, "lang": lang}
+        for lang in set(bundle.get("languages") or [])
+        if lang
+    ]
+
+    rows[ProfileUniversity] = [
+        {
+            "profile_id": profile_id,
+            "university_id": u.get("id"),
+            "name": u.get("name"),
+            "faculty_id": u.get("faculty"),
+            "faculty_name": u.get("faculty_name"),
+            "chair_id": u.get("chair"),
+            "chair_name": u.get("chair_name"),
+            "graduation": u.get("graduation"),
+        }
+        for u in bundle.get("universities") or []
+    ]
+
+    rows[ProfileSchool] = [
+        {
+            "profile_id": profile_id,
+            "school_id": s.get("id"),
+            "name": s.get("name"),
+            "year_from": s.get("year_from"),
+            "year_to": s.get("year_to"),
+            "year_graduated": s.get("year_graduated"),
+            "clazz": s.get("class"),
+            "speciality": s.get("speciality"),
+        }
+        for s in bundle.get("schools") or []
+    ]
+
+    rows[ProfileCareer] = [
+        {
+            "profile_id": profile_id,
+            "company": c.get("company"),
+            "position": c.get("position"),
+            "city_id": c.get("city_id"),
+            "city_title": c.get("city_name"),
+            "from_year": c.get("from"),
+            "until_year": c.get("until"),
+        }
+        for c in bundle.get("careers") or []
+    ]
+
+    for model, batch in rows.items():
+        _write_child_rows(session, PROFILE_CHILD_INSERTS[model], batch)
+
+    for model, key_cols, key in PROFILE_SAMPLE_SPECS:
+        _sync_sample_rows(session, model, key_cols, profile_id, bundle.get(key) or [])
+
+
+def _sync_sample_rows(
+    session,
+    model,
+    key_cols: tuple[str, ...],
+    profile_id: int,
+    items: list[dict[str, Any]],
+) -> None:
+    rows = []
+    new_keys = set()
+    for item in items:
+        item_key = tuple(item.get(c) for c in key_cols)
+        if item_key in new_keys:
             continue
-        session.add(ProfileLanguage(profile_id=profile.id, lang=lang))
-
-    for u in bundle.get("universities") or []:
-        session.add(
-            ProfileUniversity(
-                profile_id=profile.id,
-                university_id=u.get("id"),
-                name=u.get("name"),
-                faculty_id=u.get("faculty"),
-                faculty_name=u.get("faculty_name"),
-                chair_id=u.get("chair"),
-                chair_name=u.get("chair_name"),
-                graduation=u.get("graduation"),
-            )
-        )
-
-    for s in bundle.get("schools") or []:
-        session.add(
-            ProfileSchool(
-                profile_id=profile.id,
-                school_id=s.get("id"),
-                name=s.get("name"),
-                year_from=s.get("year_from"),
-                year_to=s.get("year_to"),
-                year_graduated=s.get("year_graduated"),
-                clazz=s.get("class"),
-                speciality=s.get("speciality"),
-            )
+        if None not in item_key:
+            new_keys.add(item_key)
+        rows.append({**item, "profile_id": profile_id})
+    stale_ids = [
+        row_id
+        for row_id, *row_key in session.execute(
+            PROFILE_SAMPLE_EXISTING[model], {"profile_id": profile_id}
         )
-
-    for c in bundle.get("careers") or []:
-        session.add(
-            ProfileCareer(
-                profile_id=profile.id,
-                company=c.get("company"),
-                position=c.get("position"),
-                city_id=c.get("city_id"),
-                city_title=c.get("city_name"),
-                from_year=c.get("from"),
-                until_year=c.get("until"),
-            )
+        if tuple(row_key) not in new_keys or None in row_key
+    ]
+    if stale_ids:
+        session.execute(PROFILE_SAMPLE_DELETES[model], {"ids": stale_ids})
+    _write_child_rows(session, PROFILE_SAMPLE_UPSERTS[model], rows)
+
+
+def _write_child_rows(session, stmt, rows: list[dict[str, Any]]) -> None:
+    for group in group_rows_by_columns(rows):
+        try:
+            with session.begin_nested():
+                session.execute(stmt, group)
+        except IntegrityError:
+            for row in group:
+                try:
+                    with session.begin_nested():
+                        session.execute(stmt, row)
+                except IntegrityError as e:
+                    _log.warning(
+                        f"skipped {stmt.table.name} row: "
+                        f"profile_id={row.get('profile_id')} error={e.orig}"
+                    )
+
+
+def save_profile(
+    bundle: dict[str, Any], db_path: str = "vk.sqlite", now: int | None = None
+):
+    p = bundle.get("profile") or {}
+    if not p.get("user_id"):
+        raise ValueError("user_id required")
+    now = now or int(time.time())
+    with make_session(db_path) as session, session.begin():
+        profile_id = upsert_profile(session, p, now)
+        replace_profile_children(session, profile_id, bundle)
+
+
+def load_profile_full(session, user_id: int) -> Profile | None:
+    return session.execute(
+        select(Profile)
+        .where(Profile.user_id == user_id)
+        .options(
+            selectinload(Profile.counters),
+            selectinload(Profile.personal),
+            selectinload(Profile.languages),
+            selectinload(Profile.universities),
+            selectinload(Profile.schools),
+            selectinload(Profile.careers),
+            selectinload(Profile.followers_sample),
+            selectinload(Profile.subscriptions_sample),
+            selectinload(Profile.photos),
+            selectinload(Profile.videos_sample),
+            selectinload(Profile.texts),
+            selectinload(Profile.extra),
         )
+    ).scalar_one_or_none()
 
-    for f in bundle.get("friends_sample") or []:
-        session.add(ProfileFriendSample(profile_id=profile.id, **f))
-
-    for f in bundle.get("followers_sample") or []:
-        session.add(ProfileFollowerSample(profile_id=profile.id, **f))
-
-    for g in bundle.get("subscriptions_sample") or []:
-        session.add(ProfileSubscriptionSample(profile_id=profile.id, **g))
 
-    for ph in bundle.get("photos") or []:
-        session.add(ProfilePhoto(profile_id=profile.id, **ph))
-
-    for v in bundle.get("videos_sample") or []:
-        session.add(ProfileVideoSample(profile_id=profile.id, **v))
-
-
-def save_profile(bundle: dict[str, Any], db_path: str = "vk.sqlite"):
-    session = make_session(db_path)
-    p = bundle.get("profile") or {}
-    try:
-        if not p.get("user_id"):
-            raise
-        with session.no_autoflush:
-            rec = upsert_profile(session, p)
-            replace_profile_children(session, rec, bundle)
-        session.commit()
-    except Exception:
-        session.rollback()
-        raise
-    finally:
-        session.close()
+def bulk_load_context(db_path: str = "vk.sqlite"):
+    return deferred_indexes(db_path, PROFILE_DEFERRED_INDEXES)
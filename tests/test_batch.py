@@ -0,0 +1,13 @@
+import pytest
+from sqlalchemy import text
+
+from storage.batch import save_batch
+from storage.models import vk_session
+
+
+def test_save_batch_restores_synchronous_after_failure(tmp_path):
+    db_path = str(tmp_path / "vk.sqlite")
+    with pytest.raises(TypeError):
+        save_batch([None], [], db_path=db_path, durability="fast")
+    with vk_session(db_path) as session:
+        assert session.execute(text("PRAGMA synchronous")).scalar() != 0